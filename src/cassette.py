@@ -0,0 +1,190 @@
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import hmac
+import hashlib
+import logging
+import requests
+from collections import defaultdict, deque
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config.settings import *
+
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+SECRET_PATTERN = re.compile(
+    r'("(?:api_key|access_token|refresh_token|id_token)"\s*:\s*)"[^"]*"')
+SECRET_PARAMS = {'key', 'access_token', 'refresh_token', 'client_secret', 'code'}
+SECRET_KEYS = {'api_key', 'access_token', 'refresh_token', 'id_token', 'client_secret'}
+# JSON keys whose text is scrambled (same length, letters replaced)
+TEXT_KEYS = {'subject', 'content', 'bodyPreview', 'description', 'notes', 'uniqueBody'}
+# Objects that describe a person (Graph recipients, Redmine users)
+PERSON_KEYS = {'emailAddress', 'assigned_to', 'author', 'user'}
+PERSON_FIELDS = {'name', 'firstname', 'lastname', 'login', 'mail'}
+# Message headers kept for threading; other header values are scrambled
+THREAD_HEADERS = {'message-id', 'in-reply-to', 'references'}
+HTML_TAG = re.compile(r'(<[^>]*>)')
+LETTER = re.compile(r'[^\W\d_]')
+
+
+def scramble(text):
+    # Letters become x, digits, punctuation and HTML tags are kept, so issue
+    # IDs in subjects and the size of every body survive.
+    return ''.join(part if part.startswith('<') else LETTER.sub('x', part)
+                   for part in HTML_TAG.split(text))
+
+
+class Redactor:
+    def __init__(self, salt=None):
+        # The salt is random per cassette and never written to it, so the
+        # pseudonyms cannot be reversed by hashing known addresses.
+        self.salt = salt or os.urandom(32)
+
+    def pseudonym(self, value):
+        return hmac.new(self.salt, value.lower().encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+    def text(self, text):
+        text = SECRET_PATTERN.sub(r'\1"[REDACTED]"', text)
+        return EMAIL_PATTERN.sub(
+            lambda m: self.pseudonym(m.group(0)) + '@example.invalid', text)
+
+    def url(self, url):
+        parts = urlsplit(url)
+        query = [(k, '[REDACTED]' if k in SECRET_PARAMS else self.text(v))
+                 for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+        return urlunsplit(parts._replace(path=self.text(parts.path), query=urlencode(query)))
+
+    def json(self, value, key=None, person=False):
+        if isinstance(value, dict):
+            if {'name', 'value'} <= set(value) and key == 'internetMessageHeaders':
+                return dict(value, value=self.header(value['name'], value['value']))
+            return {k: self.json(v, k, person or k in PERSON_KEYS) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.json(v, key, person) for v in value]
+        if not isinstance(value, str):
+            return value
+        if key in SECRET_KEYS:
+            return '[REDACTED]'
+        if key == 'contentBytes':
+            # Same decoded size, all zero bytes
+            return 'A' * len(value.rstrip('=')) + '=' * (len(value) - len(value.rstrip('=')))
+        if person and key in PERSON_FIELDS:
+            return self.text(value) if '@' in value else 'Person ' + self.pseudonym(value)
+        if key == 'name' or key in TEXT_KEYS:
+            # Attachment names, subjects and bodies
+            return scramble(self.text(value))
+        return self.text(value)
+
+    def header(self, name, value):
+        if name.lower() in THREAD_HEADERS:
+            return self.text(value)
+        return scramble(self.text(value))
+
+    def content(self, content):
+        # Response body as stored in the cassette
+        text = content.decode('utf-8')
+        try:
+            return json.dumps(self.json(json.loads(text)))
+        except ValueError:
+            return self.text(text)
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette:
+    def __init__(self,
+                 mode = CASSETTE_CONFIG['mode'],
+                 cassette_file = CASSETTE_CONFIG['file'],
+                 latency = CASSETTE_CONFIG['latency']):
+        # Records every HTTP exchange made through requests (Graph, Redmine
+        # via python-redmine, MSAL) to a gzipped JSON-lines file, or serves
+        # them back from that file without touching the network.
+        self.mode = mode
+        self.latency = latency
+        if mode == 'record' and not cassette_file:
+            stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+            cassette_file = f"data/cassettes/cycle-{stamp}.jsonl.gz"
+        self.cassette_file = Path(__file__).resolve().parent / cassette_file
+        self.interactions = defaultdict(deque)
+        self.redactor = Redactor()
+        self.out = None
+        self.original_request = None
+        self.logger = logging.getLogger(__name__)
+
+    def __enter__(self):
+        cassette = self
+        self.original_request = requests.Session.request
+        if self.mode == 'record':
+            os.makedirs(self.cassette_file.parent, exist_ok=True)
+            self.out = gzip.open(self.cassette_file, 'wt', encoding='utf-8')
+
+            def request(session, method, url, *args, **kwargs):
+                return cassette.record(session, method, url, *args, **kwargs)
+        else:
+            with gzip.open(self.cassette_file, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    interaction = json.loads(line)
+                    self.interactions[self.match_key(
+                        interaction['method'], interaction['url'])].append(interaction)
+
+            def request(session, method, url, *args, **kwargs):
+                return cassette.replay(method, url)
+        requests.Session.request = request
+        self.logger.info(f"Cassette {self.mode} mode: {self.cassette_file}")
+        return self
+
+    def __exit__(self, *exc_info):
+        requests.Session.request = self.original_request
+        if self.out:
+            self.out.close()
+        return False
+
+    def match_key(self, method, url):
+        # Addresses in a path are pseudonymised when recorded, so they are
+        # left out of the match
+        parts = urlsplit(url)
+        return method.upper(), parts.netloc, EMAIL_PATTERN.sub('[email]', parts.path)
+
+    def record(self, session, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        response = self.original_request(session, method, url, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        try:
+            content = {'text': self.redactor.content(response.content)}
+        except UnicodeDecodeError:
+            content = {'base64': base64.b64encode(response.content).decode()}
+        self.out.write(json.dumps({
+            'method': method.upper(),
+            'url': self.redactor.url(url),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type'),
+            'elapsed': round(elapsed, 4),
+            **content,
+        }) + '\n')
+        return response
+
+    def replay(self, method, url):
+        queue = self.interactions.get(self.match_key(method, url))
+        if not queue:
+            raise CassetteMiss(f"No recorded response for {method.upper()} {url}")
+        interaction = queue.popleft()
+        if self.latency == 'recorded':
+            time.sleep(interaction['elapsed'])
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.url = url
+        response.encoding = 'utf-8'
+        if 'text' in interaction:
+            response._content = interaction['text'].encode('utf-8')
+        else:
+            response._content = base64.b64decode(interaction['base64'])
+        if interaction['content_type']:
+            response.headers['Content-Type'] = interaction['content_type']
+        response.elapsed = timedelta(seconds=interaction['elapsed'])
+        response.request = requests.Request(method.upper(), url).prepare()
+        return response
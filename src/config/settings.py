@@ -1,12 +1,23 @@
 import os
 import json
+import time
+import queue
+import atexit
+import logging.config
+import logging.handlers
+from contextvars import ContextVar
+from collections.abc import Mapping
 from pathlib import Path
 
 # Base Directory
 BASE_DIR = Path(__file__).parent.parent
 
 log_dir = Path(__file__).resolve().parent.parent.parent / "logs"
-log_dir.mkdir(parents=True, exist_ok=True)
+# "text" or "json"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Identical messages from one logger, project and email are logged at most
+# once per window; 0 turns rate limiting off
+LOG_REPEAT_SECONDS = int(os.getenv("LOG_REPEAT_SECONDS", "0"))
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -72,6 +83,36 @@ LOGGING_CONFIG = {
             "level": "INFO",
             "propagate": False,
         },
+        "thread_index": {
+            "handlers": ["main_handler", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "issue_snapshot": {
+            "handlers": ["main_handler", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "issue_cache": {
+            "handlers": ["main_handler", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "routing": {
+            "handlers": ["main_handler", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "lease": {
+            "handlers": ["main_handler", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "cassette": {
+            "handlers": ["main_handler", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
     "root": {"handlers": ["console"], "level": "WARNING"},
 }
@@ -79,6 +120,8 @@ LOGGING_CONFIG = {
 EMAIL_CONFIG = {
     "mailbox": os.getenv("MAILBOX_FOLDER"),
     "processed_files": "data/processed_time.txt",
+    # Parsed bodies longer than this (characters) are kept on disk until used
+    "body_spill_size": 64 * 1024,
 }
 # Redmine
 REDMINE_CONFIG = {
@@ -86,6 +129,28 @@ REDMINE_CONFIG = {
     "apikey": os.getenv("REDMINE_APIKEY"),
     "project_id": "",
     "processed_files": "data/processed_issue.txt",
+    "thread_index_dir": "data/thread_index",
+    # Most recently recorded conversations and Message-IDs kept per project
+    "thread_index_size": 10000,
+    "snapshot_dir": "data/issue_snapshots",
+    # Most recently updated issues whose snapshots are kept per project
+    "snapshot_size": 5000,
+}
+
+# Sharding projects across several workers
+SHARDING_CONFIG = {
+    "enabled": os.getenv("SHARDING_ENABLED", "false").lower() == "true",
+    "worker_id": os.getenv("WORKER_ID"),
+    "lease_seconds": int(os.getenv("LEASE_SECONDS", "300")),
+    "store_file": "data/leases.sqlite",
+}
+
+# Capture and replay of HTTP traffic for offline profiling
+CASSETTE_CONFIG = {
+    "mode": os.getenv("CASSETTE_MODE", ""),  # "", "record" or "replay"
+    "file": os.getenv("CASSETTE_FILE", ""),
+    "latency": os.getenv("CASSETTE_LATENCY", "recorded"),  # "recorded" or "zero"
+    "profile": os.getenv("CASSETTE_PROFILE", ""),
 }
 
 
@@ -99,4 +164,138 @@ def load_config(config_path):
 
 config_path = "./config.json"
 
-APP_CONFIG = load_config(config_path)
+
+class LazyConfig(Mapping):
+    """Read-only view of config.json that is only parsed on first access."""
+
+    def __init__(self, path):
+        self._path = path
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            self._data = load_config(self._path)
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+APP_CONFIG = LazyConfig(config_path)
+
+
+correlation_id = ContextVar("correlation_id", default="-")
+log_project = ContextVar("log_project", default="-")
+
+
+def set_correlation_id(value):
+    correlation_id.set(value or "-")
+
+
+def set_log_project(value):
+    log_project.set(value or "-")
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        record.project = log_project.get()
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    # Drops a message already logged by the same logger for the same project
+    # and email within the window; the next one that gets through reports how
+    # many were dropped.
+    def __init__(self, window=LOG_REPEAT_SECONDS):
+        super().__init__()
+        self.window = window
+        self.seen = {}
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.project,
+               record.correlation_id, record.getMessage())
+        now = time.monotonic()
+        last, dropped = self.seen.get(key, (None, 0))
+        if last is not None and now - last < self.window:
+            self.seen[key] = (last, dropped + 1)
+            return False
+        if dropped:
+            record.msg = f"{record.getMessage()} (repeated {dropped} more times)"
+            record.args = None
+        if len(self.seen) > 1000:
+            self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+        self.seen[key] = (now, 0)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "project": getattr(record, "project", "-"),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RoutingHandler(logging.Handler):
+    # Runs on the listener thread and hands each record to the handlers that
+    # LOGGING_CONFIG attached to the record's logger.
+    def __init__(self, routes, default):
+        super().__init__()
+        self.routes = routes
+        self.default = default
+
+    def emit(self, record):
+        for handler in self.routes.get(record.name, self.default):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_listener = None
+
+
+def configure_logging():
+    # Builds the handlers from LOGGING_CONFIG once per process and moves them
+    # behind a QueueListener, so writing logs never blocks the caller.
+    global _listener
+    if _listener is not None:
+        return
+    log_dir.mkdir(parents=True, exist_ok=True)
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+    names = list(LOGGING_CONFIG["loggers"]) + [""]
+    routes = {}
+    for name in names:
+        logger = logging.getLogger(name)
+        routes[name] = list(logger.handlers)
+        for handler in routes[name]:
+            logger.removeHandler(handler)
+    if LOG_FORMAT == "json":
+        for handler in {h for handlers in routes.values() for h in handlers}:
+            handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+    if LOG_REPEAT_SECONDS > 0:
+        queue_handler.addFilter(RepeatFilter())
+    for name in names:
+        logging.getLogger(name).addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, RoutingHandler(routes, routes[""]))
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -2,19 +2,69 @@ import re
 import logging
 import requests
 import base64
+import tempfile
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from bs4 import BeautifulSoup
 from config.settings import *
 
 
+MESSAGE_FIELDS = ','.join([
+    'id', 'subject', 'from', 'receivedDateTime', 'body',
+    'conversationId', 'internetMessageId', 'internetMessageHeaders'])
+
+
+class EmailRecord:
+    # Parsed email handed to RedmineHandler. Bodies longer than
+    # EMAIL_CONFIG['body_spill_size'] characters are written to a temporary
+    # file next to the attachments and only read back when accessed.
+    __slots__ = ('subject', 'issue_id', 'sender', 'email_addr', 'time',
+                 'attachments', 'conversation_id', 'message_id', 'in_reply_to',
+                 '_body', '_body_file')
+
+    def __init__(self, subject, issue_id, sender, email_addr, time, body,
+                 attachments, conversation_id=None, message_id=None,
+                 in_reply_to=(), spill_dir=None,
+                 spill_size=EMAIL_CONFIG['body_spill_size']):
+        self.subject = subject
+        self.issue_id = issue_id
+        self.sender = sender
+        self.email_addr = email_addr
+        self.time = time
+        self.attachments = attachments
+        self.conversation_id = conversation_id
+        self.message_id = message_id
+        self.in_reply_to = in_reply_to
+        self._body = body
+        self._body_file = None
+        if spill_dir is not None and len(body) > spill_size:
+            fd, self._body_file = tempfile.mkstemp(dir=spill_dir, suffix='.body')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(body)
+            self._body = None
+
+    @property
+    def body(self):
+        if self._body_file is None:
+            return self._body
+        with open(self._body_file, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def body_head(self, chars):
+        # First chars characters of the body without loading a spilled body
+        if self._body_file is None:
+            return self._body[:chars]
+        with open(self._body_file, 'r', encoding='utf-8') as f:
+            return f.read(chars)
+
 
 class EmailReader:
     def __init__(self, 
                  project_id = None,
                  access_token = None,
                  mailbox=EMAIL_CONFIG['mailbox'],
-                 time_file=EMAIL_CONFIG['processed_files']):
+                 time_file=EMAIL_CONFIG['processed_files'],
+                 attachments_folder="attachments",
+                 body_spill_size=EMAIL_CONFIG['body_spill_size']):
         self.access_token = access_token
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
@@ -22,122 +72,197 @@ class EmailReader:
         }
         self.mailbox = mailbox
         self.time_file = Path(__file__).resolve().parent / time_file
+        self.attachments_folder = Path(__file__).resolve().parent / attachments_folder
+        self.body_spill_size = body_spill_size
         self.project_id = project_id
+        self.processed_time = None
+        self.processed_ids = set()
         self.emails = []
         self.emails_data = []
         self.logger = logging.getLogger(__name__)
 
     def connect_read(self):
         self.logger.info(f"{'='*5} Email check cycle began {'='*5}")
-        last_time = self.load_processed_time()
-        
-        url = f"https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages?$orderby=receivedDateTime asc&$filter=receivedDateTime gt {last_time}&$top=10"
+        for emails in self.fetch_pages():
+            self.emails.extend(emails)
+        self.logger.info(f"{len(self.emails)} email IDs loaded.")
+
+    def fetch_pages(self, page_size=10):
+        # Yields one Graph page of messages at a time, oldest first. Messages
+        # received at the saved time are requested again and the ones already
+        # committed are skipped, so a checkpoint between two messages with the
+        # same receivedDateTime loses neither of them.
+        last_time, committed_ids = self.load_processed_time()
+        operator = 'ge' if committed_ids else 'gt'
+
+        url = f"https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages?$orderby=receivedDateTime asc&$filter=receivedDateTime {operator} {last_time}&$top={page_size}&$select={MESSAGE_FIELDS}"
         while url:
             response = requests.get(url, headers=self.headers)
             if response.status_code != 200:
                 print("FAIL", response.status_code, response.text)
                 break
             data = response.json()
-            emails = data.get("value", [])
-            self.emails.extend(emails)
+            emails = [email for email in data.get("value", [])
+                      if email["id"] not in committed_ids]
+            if emails:
+                yield emails
             url = data.get("@odata.nextLink")
-        self.logger.info(f"{len(self.emails)} email IDs loaded.")
 
     def load_processed_time(self):
+        # The time file holds the receivedDateTime of the last committed
+        # message, followed by the IDs of the messages committed at that time.
+        # Returns the time and the set of those IDs.
         if not os.path.exists(self.time_file):
             self.logger.info(f"No email time file found. Returning the current time.")
-            return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+            return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), set()
         try:
             with open(self.time_file, 'r') as f:
-                time_str = f.read().strip()
-                if time_str:
+                lines = f.read().split()
+                if lines:
+                    time_str = lines[0]
                     self.logger.info(f"Last processed time loaded: {time_str}")
-                    dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-                    dt_plus_one = dt + timedelta(seconds=1)
-                    return dt_plus_one.isoformat(timespec='seconds').replace('+00:00', 'Z')
+                    self.processed_time, self.processed_ids = time_str, set(lines[1:])
+                    return time_str, set(self.processed_ids)
                 else:
                     self.logger.info("Time file is empty. Returning current time.")
-                    return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+                    return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), set()
         except IOError as e:
             self.logger.info(f"Error loading time from file. Returning current time.")
-            return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+            return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), set()
         
     def reading_emails(self):
         if not self.emails:
             self.logger.info('No new emails.')
         else:
-            for email in self.emails:
-                # Subject
-                issue_id, subject = self.clean_subject(email["subject"])
-
-                emailignore = APP_CONFIG["projects"][self.project_id]["emailignore"]
-                if emailignore["startwith"]:   
-                    escaped = [re.escape(p) for p in emailignore["startwith"]]
-                    pattern = r'^(?:' + '|'.join(escaped) + ')'
-                    regex = re.compile(pattern)
-                    if bool(regex.match(subject)):
-                        continue
-                if emailignore["contain"]:
-                    escaped = [re.escape(p) for p in emailignore["contain"]]
-                    pattern = r'(?:' + '|'.join(escaped) + r')'
-                    if re.search(pattern, subject):
-                        continue
-                if emailignore["endwith"]:
-                    escaped = [re.escape(p) for p in emailignore["endwith"]]
-                    pattern = r'(?:' + '|'.join(escaped) + r')$'
-                    if re.search(pattern, subject):
-                        continue
-
-                # Name and Address
-                from_info = email.get("from", {}).get("emailAddress", {})
-                name = from_info.get("name", "Unknown")
-                address = from_info.get("address", "Unknown")
-                # Time
-                email_date = datetime.strptime(email['receivedDateTime'], "%Y-%m-%dT%H:%M:%SZ").astimezone()
-                # Body
-                html_content = email["body"]["content"]
-                plain_text = BeautifulSoup(html_content, "html.parser").get_text()
-                plain_text = self.clean_email_body(plain_text)
-                # Attachments
-                message_id = email["id"]
-                attachments_dir = Path(__file__).resolve().parent / "attachments" / {message_id}
-                os.makedirs(attachments_dir, exist_ok=True)
-                file_paths = []
-                attachment_url = f"https://graph.microsoft.com/v1.0/me/messages/{message_id}/attachments"
-                att_response = requests.get(attachment_url, headers=self.headers)
-                if att_response.status_code != 200:
-                    print(f"FAIL: {att_response.status_code} {att_response.text}")
-                    continue
-                attachments = att_response.json().get("value", [])
-                for att in attachments:
-                    filename = att["name"]
-                    # content_type = att["contentType"]
-                    # size = att["size"]
-                    # content_id = att.get("contentId")
-                    # Download att
-                    if att["@odata.type"] == "#microsoft.graph.fileAttachment":
-                        content_bytes = att["contentBytes"]
-                        content_bytes = base64.b64decode(content_bytes)
-                        filepath = os.path.join(attachments_dir, filename)
-                        with open(filepath, "wb") as f:
-                            f.write(content_bytes)
-                        file_paths.append(filepath)
-
-                email_data = {
-                'subject': subject.strip(),
-                'issue_id': issue_id, # can delete
-                'sender': name,
-                'email_addr': address,
-                'time': email_date,
-                'body': plain_text.strip(),
-                'attachments': file_paths}
-                self.emails_data.append(email_data)
+            # Release each raw Graph payload as soon as it is parsed
+            emails, self.emails = self.emails, []
+            latest_time, latest_ids = self.latest_processed(emails)
+            emails.reverse()
+            while emails:
+                email_data = self.parse_email(emails.pop())
+                if email_data:
+                    self.emails_data.append(email_data)
+            set_correlation_id(None)
             # Save the latest time
-            latest_time = self.emails[-1]["receivedDateTime"]
-            with open(self.time_file, "w") as f:
-                f.write(latest_time)
+            self.save_processed_time(latest_time, latest_ids)
         self.logger.info(f"{'='*5} Email check cycle finished {'='*5}")
 
+    def catch_up(self, handle_page, page_size=10, max_pages=None):
+        # Streams the backlog one page at a time. The time file is saved after
+        # each page has been handled, so an interrupted run resumes from the
+        # last committed page and memory stays bounded by the page size.
+        self.logger.info(f"{'='*5} Email catch-up cycle began {'='*5}")
+        pages = 0
+        for emails in self.fetch_pages(page_size):
+            self.emails_data = []
+            for email in emails:
+                email_data = self.parse_email(email)
+                if email_data:
+                    self.emails_data.append(email_data)
+            if self.emails_data:
+                handle_page(self.emails_data)
+            self.save_processed_time(*self.latest_processed(emails))
+            pages += 1
+            self.logger.info(f"Page {pages} committed ({len(emails)} emails).")
+            if max_pages and pages >= max_pages:
+                self.logger.info(f"Page limit {max_pages} reached, resuming next cycle.")
+                break
+        self.emails_data = []
+        self.logger.info(f"{'='*5} Email catch-up cycle finished {'='*5}")
+
+    def parse_email(self, email):
+        from bs4 import BeautifulSoup
+
+        set_correlation_id(email.get("internetMessageId") or email["id"])
+        # Subject
+        issue_id, subject = self.clean_subject(email["subject"])
+
+        emailignore = APP_CONFIG["projects"][self.project_id]["emailignore"]
+        if emailignore["startwith"]:   
+            escaped = [re.escape(p) for p in emailignore["startwith"]]
+            pattern = r'^(?:' + '|'.join(escaped) + ')'
+            regex = re.compile(pattern)
+            if bool(regex.match(subject)):
+                return None
+        if emailignore["contain"]:
+            escaped = [re.escape(p) for p in emailignore["contain"]]
+            pattern = r'(?:' + '|'.join(escaped) + r')'
+            if re.search(pattern, subject):
+                return None
+        if emailignore["endwith"]:
+            escaped = [re.escape(p) for p in emailignore["endwith"]]
+            pattern = r'(?:' + '|'.join(escaped) + r')$'
+            if re.search(pattern, subject):
+                return None
+
+        # Name and Address
+        from_info = email.get("from", {}).get("emailAddress", {})
+        name = from_info.get("name", "Unknown")
+        address = from_info.get("address", "Unknown")
+        # Time
+        email_date = datetime.strptime(email['receivedDateTime'], "%Y-%m-%dT%H:%M:%SZ").astimezone()
+        # Body
+        html_content = email["body"]["content"]
+        plain_text = BeautifulSoup(html_content, "html.parser").get_text()
+        plain_text = self.clean_email_body(plain_text)
+        # Threading
+        headers = {h["name"].lower(): h["value"]
+                   for h in email.get("internetMessageHeaders") or []}
+        in_reply_to = tuple(re.findall(r'<[^<>]+>', ' '.join([
+            headers.get("in-reply-to", ""), headers.get("references", "")])))
+        # Attachments
+        message_id = email["id"]
+        attachments_dir = self.attachments_folder / message_id
+        os.makedirs(attachments_dir, exist_ok=True)
+        file_paths = []
+        attachment_url = f"https://graph.microsoft.com/v1.0/me/messages/{message_id}/attachments"
+        att_response = requests.get(attachment_url, headers=self.headers)
+        if att_response.status_code != 200:
+            print(f"FAIL: {att_response.status_code} {att_response.text}")
+            return None
+        attachments = att_response.json().get("value", [])
+        for att in attachments:
+            filename = att["name"]
+            # content_type = att["contentType"]
+            # size = att["size"]
+            # content_id = att.get("contentId")
+            # Download att
+            if att["@odata.type"] == "#microsoft.graph.fileAttachment":
+                content_bytes = att["contentBytes"]
+                content_bytes = base64.b64decode(content_bytes)
+                filepath = os.path.join(attachments_dir, filename)
+                with open(filepath, "wb") as f:
+                    f.write(content_bytes)
+                file_paths.append(filepath)
+
+        return EmailRecord(
+            subject=subject.strip(),
+            issue_id=issue_id, # can delete
+            sender=name,
+            email_addr=address,
+            time=email_date,
+            body=plain_text.strip(),
+            attachments=file_paths,
+            conversation_id=email.get("conversationId"),
+            message_id=email.get("internetMessageId"),
+            in_reply_to=in_reply_to,
+            spill_dir=attachments_dir,
+            spill_size=self.body_spill_size)
+
+    def latest_processed(self, emails):
+        # Time of the last email and the IDs of every email committed at that
+        # time, including those of earlier pages with the same time.
+        latest_time = emails[-1]["receivedDateTime"]
+        latest_ids = {email["id"] for email in emails if email["receivedDateTime"] == latest_time}
+        if latest_time == self.processed_time:
+            latest_ids |= self.processed_ids
+        return latest_time, latest_ids
+
+    def save_processed_time(self, latest_time, message_ids=()):
+        with open(self.time_file, "w") as f:
+            f.write('\n'.join([latest_time, *sorted(message_ids)]))
+        self.processed_time, self.processed_ids = latest_time, set(message_ids)
+
     # def clean_subject(self, subject):
     #    return re.sub(r'^(?:RE:\s*|FW:\s*|FWD:\s*|回复:\s*|转发:\s*|回覆:\s*|轉寄:\s*|轉發:\s*)+', '', subject, flags=re.IGNORECASE).strip()
     def clean_subject(self, subject):
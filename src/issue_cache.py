@@ -0,0 +1,52 @@
+import logging
+from config.settings import *
+
+
+class IssueCache:
+    def __init__(self):
+        # Issues seen during one cycle, shared by MonitorSender and
+        # RedmineHandler so each issue is requested from Redmine at most once.
+        self.issues = {}
+        self.with_journals = set()
+        self.missing = set()
+        self.logger = logging.getLogger(__name__)
+
+    def put(self, issue):
+        # A cached entry is kept while its updated_on still matches, since it
+        # may already carry journals the newer copy does not have.
+        cached = self.issues.get(issue.id)
+        if cached is not None and cached.updated_on == issue.updated_on:
+            return cached
+        self.issues[issue.id] = issue
+        self.with_journals.discard(issue.id)
+        self.missing.discard(issue.id)
+        return issue
+
+    def prefetch(self, redmine, issue_ids):
+        # One filter request for every ID that is not cached yet.
+        wanted = {int(i) for i in issue_ids if i} - set(self.issues) - self.missing
+        if not wanted:
+            return
+        found = redmine.issue.filter(
+            issue_id=','.join(str(i) for i in sorted(wanted)),
+            status_id='*')
+        for issue in found:
+            self.put(issue)
+        self.missing.update(wanted - set(self.issues))
+        self.logger.info(f"{len(wanted)} issues prefetched, {len(wanted - set(self.issues))} not found.")
+
+    def get(self, redmine, issue_id):
+        issue_id = int(issue_id)
+        if issue_id not in self.issues and issue_id not in self.missing:
+            self.prefetch(redmine, [issue_id])
+        return self.issues.get(issue_id)
+
+    def get_with_journals(self, redmine, issue_id):
+        issue_id = int(issue_id)
+        if issue_id in self.with_journals:
+            return self.issues[issue_id]
+        issue = redmine.issue.get(issue_id, include='journals')
+        self.issues[issue_id] = issue
+        self.with_journals.add(issue_id)
+        self.missing.discard(issue_id)
+        return issue
@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+from pathlib import Path
+from config.settings import *
+
+# Issue fields that MonitorSender compares, with the reminderconfig option
+# that turns notifications for each of them on.
+TRACKED_FIELDS = {
+    'status_id': 'status_change',
+    'priority_id': 'priority_change',
+    'tracker_id': 'tracker_change',
+    'assigned_to_id': 'assignee_change',
+}
+
+
+class IssueSnapshots:
+    def __init__(self,
+                 project_id = None,
+                 snapshot_dir = REDMINE_CONFIG['snapshot_dir'],
+                 max_issues = REDMINE_CONFIG['snapshot_size']):
+        # Last seen tracked fields and last note ID of each watched issue, so
+        # only issues whose fields actually changed need their journals. Only
+        # the max_issues most recently updated issues are saved; an issue
+        # without a snapshot is handled as before snapshots existed.
+        self.project_id = project_id
+        self.snapshot_file = Path(__file__).resolve().parent / snapshot_dir / f"{project_id}.json"
+        self.max_issues = max_issues
+        self.issues = {}
+        self.changed = False
+        self.logger = logging.getLogger(__name__)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                self.issues = json.load(f)
+        except IOError as e:
+            self.logger.error(f"Failed to load issue snapshots {self.snapshot_file}: {e}")
+        except ValueError as e:
+            # Keep the corrupt file for inspection instead of letting the next
+            # save() overwrite it
+            corrupt_file = self.snapshot_file.with_suffix('.corrupt')
+            os.replace(self.snapshot_file, corrupt_file)
+            self.logger.error(f"Failed to load issue snapshots {self.snapshot_file}, moved to {corrupt_file}: {e}")
+
+    def save(self):
+        if not self.changed:
+            return
+        for issue_id in list(self.issues)[:max(len(self.issues) - self.max_issues, 0)]:
+            del self.issues[issue_id]
+        os.makedirs(self.snapshot_file.parent, exist_ok=True)
+        tmp_file = self.snapshot_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.issues, f)
+        os.replace(tmp_file, self.snapshot_file)
+        self.changed = False
+
+    @staticmethod
+    def fields(issue):
+        # python-redmine raises ResourceAttrError for unset attributes such as
+        # the assignee of an unassigned issue, so every lookup has a default.
+        return {
+            'status_id': getattr(getattr(issue, 'status', None), 'id', None),
+            'priority_id': getattr(getattr(issue, 'priority', None), 'id', None),
+            'tracker_id': getattr(getattr(issue, 'tracker', None), 'id', None),
+            'assigned_to_id': getattr(getattr(issue, 'assigned_to', None), 'id', None),
+        }
+
+    def diff(self, issues):
+        # Single pass over the listed issues. Returns the current fields and,
+        # per issue, the names of changed fields, or None for an issue that
+        # has no snapshot yet.
+        current = {str(issue.id): self.fields(issue) for issue in issues}
+        changes = {
+            issue_id: None if issue_id not in self.issues else [
+                name for name, value in fields.items()
+                if self.issues[issue_id].get(name) != value]
+            for issue_id, fields in current.items()
+        }
+        return current, changes
+
+    def last_note_id(self, issue_id):
+        # Returns False when the notes of the issue have never been read.
+        return self.issues.get(str(issue_id), {}).get('last_note_id', False)
+
+    def update(self, issue_id, fields, last_note_id=False):
+        # The issue moves to the end, which keeps the most recently updated
+        # issues when the snapshots are pruned.
+        issue_id = str(issue_id)
+        previous = self.issues.pop(issue_id, None)
+        snapshot = dict(previous or {}, **fields)
+        if last_note_id is not False:
+            snapshot['last_note_id'] = last_note_id
+        self.issues[issue_id] = snapshot
+        if previous != snapshot:
+            self.changed = True
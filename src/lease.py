@@ -0,0 +1,114 @@
+import os
+import math
+import uuid
+import time
+import socket
+import sqlite3
+import logging
+from pathlib import Path
+from config.settings import *
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class LeaseStore:
+    def __init__(self,
+                 store_file = SHARDING_CONFIG['store_file'],
+                 lease_seconds = SHARDING_CONFIG['lease_seconds'],
+                 worker_id = SHARDING_CONFIG['worker_id']):
+        # Project leases shared by all workers through one SQLite file on the
+        # data volume. A lease that is not renewed within lease_seconds is
+        # free to be claimed by another worker. The worker ID (the host) sets
+        # the fair share, while each lease belongs to one run of the worker, so
+        # an overlapping cron run on the same host does not take over projects
+        # that the previous run is still working on.
+        self.store_file = Path(__file__).resolve().parent / store_file
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or socket.gethostname()
+        self.holder = f"{self.worker_id}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(self.store_file.parent, exist_ok=True)
+        self.conn = sqlite3.connect(self.store_file, timeout=30, isolation_level=None)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "project_id TEXT PRIMARY KEY, owner TEXT, holder TEXT, expires_at REAL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "worker_id TEXT PRIMARY KEY, seen_at REAL)")
+
+    def claim(self, project_ids):
+        # Returns the projects this worker holds after taking its fair share.
+        # Each worker keeps at most ceil(projects / live workers) leases, so
+        # projects move to a new worker when it joins and are picked up by the
+        # others once a dead worker's leases expire.
+        now = time.time()
+        expires_at = now + self.lease_seconds
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "INSERT INTO workers (worker_id, seen_at) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET seen_at = excluded.seen_at",
+                (self.worker_id, now))
+            self.conn.execute(
+                "DELETE FROM workers WHERE seen_at < ?", (now - self.lease_seconds,))
+            live_workers = self.conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+            quota = math.ceil(len(project_ids) / max(live_workers, 1))
+
+            leases = dict(
+                (row[0], (row[1], row[2], row[3]))
+                for row in self.conn.execute(
+                    "SELECT project_id, owner, holder, expires_at FROM leases"))
+            live = {p: lease for p, lease in leases.items() if lease[2] > now}
+            owned = [p for p in project_ids if p in live and live[p][1] == self.holder]
+            # Projects still held by another run on this host count towards
+            # the host's share
+            quota -= sum(1 for p in project_ids
+                         if p in live and live[p][0] == self.worker_id and live[p][1] != self.holder)
+            quota = max(quota, 0)
+            for project_id in owned[quota:]:
+                self.release(project_id)
+            owned = owned[:quota]
+            for project_id in project_ids:
+                if len(owned) >= quota:
+                    break
+                if project_id in owned:
+                    continue
+                if project_id in live:
+                    continue
+                owned.append(project_id)
+            for project_id in owned:
+                self.conn.execute(
+                    "INSERT INTO leases (project_id, owner, holder, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(project_id) DO UPDATE SET owner = excluded.owner, "
+                    "holder = excluded.holder, expires_at = excluded.expires_at",
+                    (project_id, self.worker_id, self.holder, expires_at))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.logger.info(f"Worker {self.worker_id} holds {len(owned)} of {len(project_ids)} projects.")
+        return owned
+
+    def renew(self, project_id):
+        now = time.time()
+        updated = self.conn.execute(
+            "UPDATE leases SET expires_at = ? "
+            "WHERE project_id = ? AND holder = ? AND expires_at > ?",
+            (now + self.lease_seconds, project_id, self.holder, now)).rowcount
+        self.conn.execute(
+            "UPDATE workers SET seen_at = ? WHERE worker_id = ?", (now, self.worker_id))
+        if not updated:
+            raise LeaseLost(f"Lease on project {project_id} lost by {self.worker_id}")
+
+    def release(self, project_id):
+        self.conn.execute(
+            "DELETE FROM leases WHERE project_id = ? AND holder = ?",
+            (project_id, self.holder))
+
+    def release_all(self):
+        self.conn.execute("DELETE FROM leases WHERE holder = ?", (self.holder,))
+
+    def close(self):
+        self.conn.close()
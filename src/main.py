@@ -1,14 +1,8 @@
 import os
 import sys
-import msal
+import shutil
 import logging
-import logging.config
 from pathlib import Path
-from loguru import logger
-from email_reader import EmailReader
-from redmine_handler import RedmineHandler
-from monitor_sender import MonitorSender
-from msal import PublicClientApplication
 from config.settings import *
 
 
@@ -19,7 +13,10 @@ def clear_attachments_folder(
         for filename in os.listdir(folder_path):
             file_path = os.path.join(folder_path, filename)
             try:
-                os.remove(file_path)
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+                else:
+                    os.remove(file_path)
             except Exception as e:
                 print(f"Failed to delete {file_path}. Reason: {e}")
 
@@ -28,6 +25,8 @@ def clear_attachments_folder(
 
 
 def load_cache(CACHE_FILE):
+    import msal
+
     cache = msal.SerializableTokenCache()
     if os.path.exists(Path(__file__).resolve().parent / CACHE_FILE):
         cache.deserialize(
@@ -43,8 +42,9 @@ def save_cache(cache, CACHE_FILE):
 
 
 def get_access_token(CACHE_FILE, email_address):
+    from msal import PublicClientApplication
+
     cache = load_cache(CACHE_FILE)
-    logging.config.dictConfig(LOGGING_CONFIG)
     logger = logging.getLogger("main")
     app = PublicClientApplication(
         APP_CONFIG["client_ID"],
@@ -71,36 +71,196 @@ def get_access_token(CACHE_FILE, email_address):
     return None
 
 
-def main(project_id, project_info):
-    logging.config.dictConfig(LOGGING_CONFIG)
-    access_token = get_access_token(project_info["cache_file"], project_info["email"])
+def main(project_id, project_info, leases=None):
+    from monitor_sender import MonitorSender
+    from email_reader import EmailReader
+    from issue_cache import IssueCache
+    from thread_index import ThreadIndex
+
+    set_log_project(project_id)
+    if CASSETTE_CONFIG["mode"] == "replay":
+        access_token = "replay"
+    else:
+        access_token = get_access_token(project_info["cache_file"], project_info["email"])
+
+    # Sharded workers keep their own state per project so that projects can
+    # move between workers without sharing cursors or attachment folders.
+    issue_file = REDMINE_CONFIG["processed_files"]
+    time_file = EMAIL_CONFIG["processed_files"]
+    attachments_folder = "attachments"
+    if leases:
+        issue_file = seed_state_file(
+            issue_file, f"data/processed_issue_{project_id}.txt"
+        )
+        time_file = seed_state_file(time_file, f"data/processed_time_{project_id}.txt")
+        attachments_folder = f"attachments/{project_id}"
+
+    # Issues fetched and threads recorded by the monitor pass are reused by
+    # the ingest pass
+    issue_cache = IssueCache()
+    thread_index = ThreadIndex(project_id=project_id)
 
-    monitorsender = MonitorSender(project_id=project_id, access_token=access_token)
+    monitorsender = MonitorSender(
+        project_id=project_id,
+        access_token=access_token,
+        issue_file=issue_file,
+        issue_cache=issue_cache,
+        thread_index=thread_index,
+    )
     monitorsender.find_updated_issue_within()
     monitorsender.process_emails()
+    if leases:
+        leases.renew(project_id)
 
-    emailreader = EmailReader(access_token=access_token)
+    emailreader = EmailReader(
+        project_id=project_id,
+        access_token=access_token,
+        time_file=time_file,
+        attachments_folder=attachments_folder,
+    )
     emailreader.logger = logging.getLogger("email_reader")
+
+    catchup = APP_CONFIG.get("catchup", {})
+    if catchup.get("enabled"):
+        catch_up(
+            project_id,
+            access_token,
+            emailreader,
+            catchup,
+            issue_cache,
+            thread_index,
+            leases,
+        )
+        return
+
     emailreader.connect_read()
     emailreader.reading_emails()
 
     if emailreader.emails_data:
+        from redmine_handler import RedmineHandler
+
         redminehandler = RedmineHandler(
             project_id=project_id,
             emails_data=emailreader.emails_data,
             access_token=access_token,
+            issue_cache=issue_cache,
+            thread_index=thread_index,
         )
         redminehandler.login()
+        if leases:
+            leases.renew(project_id)
         redminehandler.redmine_write()
 
 
-if __name__ == "__main__":
+def seed_state_file(shared_file, project_file):
+    # The first sharded run starts each project from the shared file, so mail
+    # and issue updates since the last unsharded run are not skipped.
+    base = Path(__file__).resolve().parent
+    if not os.path.exists(base / project_file) and os.path.exists(base / shared_file):
+        shutil.copyfile(base / shared_file, base / project_file)
+    return project_file
+
+
+def catch_up(
+    project_id,
+    access_token,
+    emailreader,
+    catchup,
+    issue_cache,
+    thread_index,
+    leases=None,
+):
+    from redmine_handler import RedmineHandler
+
+    redminehandler = RedmineHandler(
+        project_id=project_id,
+        access_token=access_token,
+        issue_cache=issue_cache,
+        thread_index=thread_index,
+    )
+
+    def write_page(emails_data):
+        if leases:
+            leases.renew(project_id)
+        if redminehandler.redmine is None:
+            redminehandler.login()
+        redminehandler.emails_data = emails_data
+        redminehandler.redmine_write()
+        clear_attachments_folder(emailreader.attachments_folder)
+
+    emailreader.catch_up(
+        write_page,
+        page_size=catchup.get("page_size", 10),
+        max_pages=catchup.get("max_pages"),
+    )
+
+
+def run_sharded():
+    from lease import LeaseStore, LeaseLost
+
+    logger = logging.getLogger("main")
+    projects = {
+        project_id: project_info
+        for project_id, project_info in APP_CONFIG["projects"].items()
+        if project_info["enabled"]
+    }
+    leases = LeaseStore()
     try:
+        for project_id in leases.claim(list(projects)):
+            try:
+                leases.renew(project_id)
+                main(project_id, projects[project_id], leases)
+            except LeaseLost as e:
+                logger.info(f"{e}. Skipping the rest of this project.")
+            finally:
+                clear_attachments_folder(
+                    Path(__file__).resolve().parent / "attachments" / project_id
+                )
+    finally:
+        # The next cron run claims afresh instead of waiting for expiry
+        leases.release_all()
+        leases.close()
+
+
+def run():
+    if SHARDING_CONFIG["enabled"]:
+        run_sharded()
+    else:
         for project_id, project_info in APP_CONFIG["projects"].items():
             if project_info["enabled"]:
                 main(project_id, project_info)
                 clear_attachments_folder()
 
+
+def run_with_cassette():
+    # Record or replay the whole cycle, optionally under cProfile. For a
+    # sampling profile run the replay under py-spy instead, e.g.
+    # py-spy record -o cycle.svg -- python src/main.py
+    from cassette import Cassette
+
+    with Cassette():
+        if CASSETTE_CONFIG["profile"]:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run)
+            finally:
+                profiler.dump_stats(CASSETTE_CONFIG["profile"])
+        else:
+            run()
+
+
+if __name__ == "__main__":
+    try:
+        configure_logging()
+        if CASSETTE_CONFIG["mode"]:
+            run_with_cassette()
+        else:
+            run()
+
     except Exception as e:
+        from loguru import logger
+
         logger.exception(f"Error occurred in main execution: {e}")
         sys.exit(1)
@@ -1,15 +1,14 @@
-import smtplib
 import logging
 import requests
 import json
 from pathlib import Path
-from html2text import html2text
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timezone, timedelta
 from redminelib import Redmine
 from config.settings import *
 from config.redmine_info import *
+from thread_index import ThreadIndex
+from issue_snapshot import IssueSnapshots, TRACKED_FIELDS
+from issue_cache import IssueCache
 
 
 class MonitorSender():
@@ -20,6 +19,8 @@ class MonitorSender():
                  issue_file = REDMINE_CONFIG['processed_files'], # Default
                  access_token = None,
                  send_url = "https://graph.microsoft.com/v1.0/me/sendMail", # Default
+                 issue_cache = None,
+                 thread_index = None,
                  ):
         self.project_id = project_id
         self.redmine = Redmine(redmine_url,
@@ -33,14 +34,19 @@ class MonitorSender():
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json"
         }
+        self.thread_index = thread_index or ThreadIndex(project_id=project_id)
+        self.snapshots = IssueSnapshots(project_id=project_id)
+        self.issue_cache = issue_cache or IssueCache()
         # logging
         self.logger = logging.getLogger(__name__)
         self.logger.info(f"{'='*5} Monitor cycle began {'='*5}")
 
-    def send_email(self, recipient, subject, html_body=None):
+    def send_email(self, recipient, subject, html_body=None, issue_id=None):
+        message_id = self.thread_index.new_message_id()
         email_msg = {
             "message": {
                 "subject": 'Re: ' + subject,
+                "internetMessageId": message_id,
                 "body": {
                     "contentType": "HTML",
                     "content": html_body
@@ -54,10 +60,14 @@ class MonitorSender():
                 ]
             }
         }
-        requests.post(self.url, headers=self.headers, data=json.dumps(email_msg))
+        response = requests.post(self.url, headers=self.headers, data=json.dumps(email_msg))
+        if issue_id and 200 <= response.status_code < 300:
+            self.thread_index.record(issue_id, message_ids=(message_id,))
         self.logger.info(f"-----Email has been sent to '{recipient}' with subject '{subject}'")
 
-    def find_updated_issue_within(self, time_interval_minutes = APP_CONFIG['check_interval']):
+    def find_updated_issue_within(self, time_interval_minutes = None):
+        if time_interval_minutes is None:
+            time_interval_minutes = APP_CONFIG['check_interval']
         last_time = None
         if os.path.exists(self.issue_file):
             with open(self.issue_file, 'r') as f:
@@ -77,7 +87,8 @@ class MonitorSender():
             status_id  = '*',
             include    = 'assigned_to')
         timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
-        recent_updated = [issue for issue in recent_updated if issue.updated_on > timestamp]
+        recent_updated = [self.issue_cache.put(issue) for issue in recent_updated
+                          if issue.updated_on > timestamp]
 
         self.updated_issues = []
         for issue in recent_updated:
@@ -86,6 +97,9 @@ class MonitorSender():
                 created_on = created_on.replace(tzinfo=timezone.utc)
             if created_on < time_ago:
                 self.updated_issues.append(issue)
+            else:
+                # Baseline for issues created within this interval
+                self.snapshots.update(issue.id, self.snapshots.fields(issue))
 
         if not self.updated_issues:
             self.logger.info('No updated issues found.')
@@ -113,20 +127,39 @@ class MonitorSender():
             return value
 
     def process_emails(self):
+        reminderconfig = APP_CONFIG['reminderconfig']
+        watched = [name for name, option in TRACKED_FIELDS.items() if reminderconfig[option]]
+        current, changes = self.snapshots.diff(self.updated_issues)
         for issue in self.updated_issues:
-            journal = list(issue.journals)[-1] if issue.journals else None
-
-            if not journal or journal.created_on != issue.updated_on:
+            set_correlation_id(f"issue-{issue.id}")
+            names = changes[str(issue.id)]
+            last_note_id = self.snapshots.last_note_id(issue.id)
+            # Journals are only needed when a watched field changed, when the
+            # issue has no snapshot yet, or when notes are watched.
+            if names is not None and not reminderconfig['notes_change'] \
+                    and not any(name in watched for name in names):
+                self.snapshots.update(issue.id, current[str(issue.id)])
                 continue
-            if not journal.detials and journal.notes.startswith("Note author ("):
+            journals = list(self.issue_cache.get_with_journals(self.redmine, issue.id).journals)
+            journal = journals[-1] if journals else None
+            notes = [j for j in journals if getattr(j, 'notes', None)]
+            self.snapshots.update(issue.id, current[str(issue.id)],
+                                  notes[-1].id if notes else None)
+
+            if names is None or last_note_id is False:
+                # No previous snapshot: use the latest journal as before
+                if not journal or journal.created_on != issue.updated_on:
+                    continue
+                if names is None:
+                    names = [detail['name'] for detail in journal.details]
+                note_changed = bool(journal.notes)
+            else:
+                note_changed = bool(notes) and notes[-1].id != last_note_id
+            if journal and not journal.details and (journal.notes or '').startswith("Note author ("):
                 continue
-            names = [detail['name'] for detail in journal.details]
             flag = any([
-                APP_CONFIG['reminderconfig']['status_change'] and 'status_id' in names,
-                APP_CONFIG['reminderconfig']['priority_change'] and 'priority_id' in names,
-                APP_CONFIG['reminderconfig']['assignee_change'] and 'assigned_to_id' in names,
-                APP_CONFIG['reminderconfig']['tracker_change'] and 'tracker_id' in names,
-                APP_CONFIG['reminderconfig']['notes_change'] and bool(journal.notes)
+                any(name in watched for name in names),
+                reminderconfig['notes_change'] and note_changed
             ])
             if not flag: continue
             # recipient
@@ -150,8 +183,6 @@ class MonitorSender():
             # else:
             #     body_spent_hours = 'None'
             # Notes
-            journals = self.redmine.issue.get(issue.id, include='journals').journals
-            notes = [j for j in journals if getattr(j, 'notes', None)]
             if not notes:
                 new_note = 'No note found.'
             else:
@@ -229,7 +260,11 @@ class MonitorSender():
 
             self.send_email(recipient,
                             f'[Issue #{issue.id}] ' + issue.subject,
-                            html_total_body)
+                            html_total_body,
+                            issue_id=issue.id)
+        set_correlation_id(None)
+        self.snapshots.save()
+        self.thread_index.save()
         self.logger.info(f"{'='*5} Monitor cycle finished {'='*5}")
 
     def main(self):
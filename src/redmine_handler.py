@@ -1,15 +1,12 @@
 import logging
-from html2text import html2text
-from email.mime.text import MIMEText
-import datetime
-import base64
 import requests
 import json
-from email.mime.multipart import MIMEMultipart
 from pathlib import Path
 from config.settings import *
 from datetime import date
-from redminelib import Redmine
+from thread_index import ThreadIndex
+from issue_cache import IssueCache
+from routing import Router, BODY_CHARS
 
 class RedmineHandler():
     def __init__(self,
@@ -18,13 +15,18 @@ class RedmineHandler():
                  redmine_apikey = REDMINE_CONFIG['apikey'],
                  send_url = "https://graph.microsoft.com/v1.0/me/sendMail",
                  access_token = None,
-                 emails_data = None):
+                 emails_data = None,
+                 issue_cache = None,
+                 thread_index = None):
         # One per login
         self.redm_url = redmine_url
         self.redm_apikey = redmine_apikey
         self.project_id = project_id
         self.emails_data = emails_data
         self.redmine = None
+        self.issue_cache = issue_cache or IssueCache()
+        self.router = Router(project_id=project_id)
+        self.routes = {}
         # One per email
         self.issue = None
         self.subject = None
@@ -33,6 +35,11 @@ class RedmineHandler():
         self.body = None
         self.time = None
         self.attachments = []
+        self.conversation_id = None
+        self.message_ids = ()
+        self.route = None
+        # Reply threading
+        self.thread_index = thread_index or ThreadIndex(project_id=project_id)
         # Graph mail.send
         self.url = send_url
         self.access_token = access_token
@@ -44,6 +51,8 @@ class RedmineHandler():
         self.logger = logging.getLogger(__name__)
 
     def login(self):
+        from redminelib import Redmine
+
         self.logger.info(f"{'='*5} Redmine handling cycle began {'='*5}")
         try:
             self.redmine = Redmine(self.redm_url, key=self.redm_apikey)
@@ -55,19 +64,26 @@ class RedmineHandler():
         #self.redmine = Redmine(self.redm_url, username = self.redm_user, password = self.redm_pass)
         #self.logger.info('Connected to Redmine.')
 
-    def load_email(self, index):
+    def load_email(self, index, with_body=True):
         email_data = self.emails_data[index]
-        self.subject = email_data['subject']
-        self.issue_id = email_data['issue_id'] # can delete
-        self.sender = email_data['sender']
-        self.email_addr = email_data['email_addr']
-        self.time = email_data['time']
-        self.body = email_data['body']
-        if email_data['attachments']:
-            self.attachments = email_data['attachments']
+        set_correlation_id(email_data.message_id)
+        self.subject = email_data.subject
+        self.issue_id = email_data.issue_id # can delete
+        self.sender = email_data.sender
+        self.email_addr = email_data.email_addr
+        self.time = email_data.time
+        self.body = email_data.body if with_body else None
+        if email_data.attachments:
+            self.attachments = email_data.attachments
         else:
             self.attachments = []
-        self.logger.info('One email loaded.')
+        self.conversation_id = email_data.conversation_id
+        self.message_ids = email_data.in_reply_to
+        if email_data.message_id:
+            self.message_ids += (email_data.message_id,)
+        self.route = self.routes.get(index)
+        if with_body:
+            self.logger.info('One email loaded.')
 
     def find_issue_id_by_subject(self):
         all_matches = self.redmine.issue.filter(
@@ -78,7 +94,7 @@ class RedmineHandler():
         self.issue = None
         for issue in all_matches:
             if issue.subject.strip() == self.subject:
-                self.issue = issue
+                self.issue = self.issue_cache.put(issue)
                 self.logger.info(f'-----Issue {issue.id} matched.')
 
     def update_issue(self):
@@ -99,6 +115,17 @@ class RedmineHandler():
         self.issue.save()
         self.logger.info(f'-----Issue updated success with ID: {self.issue.id}.')
 
+    def find_issue_id_by_thread(self):
+        self.issue = None
+        issue_id = self.thread_index.lookup(self.conversation_id, self.message_ids)
+        if issue_id:
+            try:
+                self.issue = self.issue_cache.get(self.redmine, issue_id)
+            except Exception as e:
+                self.issue = None
+            if self.issue:
+                self.logger.info(f'-----Issue {issue_id} matched by thread.')
+
     def send_email(self, html_body=None):
         # attachments = []
         # for file_path in self.attachments:
@@ -124,9 +151,11 @@ class RedmineHandler():
         #     }
         #     attachments.append(attachment)
             
+        message_id = self.thread_index.new_message_id()
         email_msg = {
             "message": {
                 "subject": f'[Issue #{self.issue.id}] ' + self.subject,
+                "internetMessageId": message_id,
                 "body": {
                     "contentType": "HTML",
                     "content": html_body
@@ -142,6 +171,7 @@ class RedmineHandler():
         }
         response = requests.post(self.url, headers=self.headers, data=json.dumps(email_msg))
         if response.status_code >= 200 and response.status_code < 300:
+            self.thread_index.record(self.issue.id, message_ids=(message_id,))
             self.logger.info(f"--Email '{self.subject}' is secussfully sent to '{self.email_addr}'.")
         else:
             self.logger.info(f"--Email '{self.subject}' to '{self.email_addr}' Failed to send.")
@@ -167,9 +197,9 @@ class RedmineHandler():
             subject        = self.subject, # from email
             description    = self.body, # from email
             status_id      = createdefault['status_id'],
-            assigned_to_id = createdefault['assigned_to_id'],
-            tracker_id     = createdefault['tracker_id'],
-            priority_id    = createdefault['priority_id'],
+            assigned_to_id = self.route['assigned_to_id'], # routed or createdefault
+            tracker_id     = self.route['tracker_id'],
+            priority_id    = self.route['priority_id'],
             custom_fields=[
                 {'id': 1, 
                  'value': createdefault['business_unit']},
@@ -200,20 +230,69 @@ class RedmineHandler():
         self.send_email(html_total_body)
         
 
+    def prefetch_issues(self):
+        # Fetch every issue referenced by this batch in one request
+        issue_ids = []
+        for email_data in self.emails_data:
+            message_ids = email_data.in_reply_to + (email_data.message_id,)
+            issue_ids.append(email_data.issue_id or self.thread_index.lookup(
+                email_data.conversation_id, [m for m in message_ids if m]))
+        try:
+            self.issue_cache.prefetch(self.redmine, issue_ids)
+        except Exception as e:
+            self.logger.info(f'Failed to prefetch issues: {e}')
+
+    def match_issue(self):
+        if self.issue_id:
+            try:
+                self.issue = self.issue_cache.get(self.redmine, self.issue_id)
+            except Exception as e:
+                self.issue = None
+        else:
+            self.find_issue_id_by_thread()
+            if not self.issue:
+                self.find_issue_id_by_subject()
+        return self.issue
+
     def redmine_write(self):
+        self.prefetch_issues()
+        # Match the whole batch first. An unmatched email opens a new issue,
+        # unless an earlier email in the batch with the same subject or
+        # conversation already does, in which case it is added to that one.
+        matches = []
+        openers = {}
         for i in range(len(self.emails_data)):
+            self.load_email(i, with_body=False)
+            issue = self.match_issue()
+            if issue is None:
+                keys = [('subject', self.subject)]
+                if self.conversation_id:
+                    keys.append(('conversation', self.conversation_id))
+                opener = next((openers[k] for k in keys if k in openers), i)
+                for key in keys:
+                    openers.setdefault(key, opener)
+                issue = opener
+            matches.append(issue)
+        # One routing call for the emails that open a new issue
+        new_issues = [i for i, match in enumerate(matches) if isinstance(match, int) and match == i]
+        routes = self.router.route([
+            (self.emails_data[i].subject, self.emails_data[i].body_head(BODY_CHARS))
+            for i in new_issues])
+        self.routes = dict(zip(new_issues, routes))
+
+        created = {}
+        for i, match in enumerate(matches):
             self.load_email(i)
-            if self.issue_id:
-                try:
-                    self.issue = self.redmine.issue.get(self.issue_id)
-                except Exception as e:
-                    self.issue = None
+            if isinstance(match, int) and match == i:
+                self.create_issue()
+                created[i] = self.issue
             else:
-                self.find_issue_id_by_subject()
-            if self.issue:
+                self.issue = created[match] if isinstance(match, int) else match
                 self.update_issue()
-            else:
-                self.create_issue()
+            self.thread_index.record(self.issue.id, self.conversation_id, self.message_ids)
+        self.routes = {}
+        set_correlation_id(None)
+        self.thread_index.save()
         self.logger.info(f"{'='*5} Redmine handling cycle finished {'='*5}")
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import math
+import mmap
+import time
+import zlib
+import array
+import logging
+import argparse
+from collections import Counter
+from pathlib import Path
+from config.settings import *
+
+# Issue fields the router can predict
+TARGETS = ['tracker_id', 'priority_id', 'assigned_to_id']
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+BODY_CHARS = 2000
+
+_models = {}
+
+
+def featurize(subject, body, n_features):
+    # Hashed bag of words. Subject words get their own features since they
+    # carry most of the signal.
+    tokens = ['s:' + t for t in TOKEN_PATTERN.findall(subject.lower())]
+    tokens += TOKEN_PATTERN.findall(body[:BODY_CHARS].lower())
+    return Counter(zlib.crc32(t.encode('utf-8')) % n_features for t in tokens)
+
+
+class RoutingModel:
+    def __init__(self, model_path):
+        # Naive Bayes weights stored as float32 in <model>.bin and memory
+        # mapped read-only, so the OS shares one copy across processes.
+        model_path = Path(__file__).resolve().parent / model_path
+        with open(f"{model_path}.json", 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.n_features = self.meta['n_features']
+        with open(f"{model_path}.bin", 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.weights = memoryview(self.buffer).cast('f')
+
+    @classmethod
+    def load(cls, model_path):
+        # One instance per model file for the lifetime of the process
+        if model_path not in _models:
+            _models[model_path] = cls(model_path)
+        return _models[model_path]
+
+    def predict(self, emails):
+        # Scores a whole batch of (subject, body) pairs in one call. Returns
+        # one {field: (value, confidence)} dict per email.
+        docs = [featurize(subject, body, self.n_features) for subject, body in emails]
+        results = [{} for _ in docs]
+        for target in self.meta['targets']:
+            classes = target['classes']
+            k = len(classes)
+            offset = target['offset']
+            bias = self.weights[offset:offset + k].tolist()
+            rows = offset + k
+            for doc, result in zip(docs, results):
+                scores = list(bias)
+                for feature, count in doc.items():
+                    start = rows + feature * k
+                    for j, w in enumerate(self.weights[start:start + k]):
+                        scores[j] += count * w
+                best = max(range(k), key=scores.__getitem__)
+                total = sum(math.exp(s - scores[best]) for s in scores)
+                result[target['name']] = (classes[best], 1.0 / total)
+        return results
+
+
+class Router:
+    def __init__(self, project_id=None):
+        # Predicts tracker, priority and assignee for new issues. Without a
+        # "routing" block in the project config the createdefault values are
+        # used unchanged.
+        self.project_id = project_id
+        self.createdefault = APP_CONFIG['projects'][project_id]['createdefault']
+        routing = APP_CONFIG['projects'][project_id].get('routing') or {}
+        self.min_confidence = routing.get('min_confidence', 0.6)
+        self.model = None
+        self.logger = logging.getLogger(__name__)
+        if routing.get('enabled') and routing.get('model'):
+            try:
+                self.model = RoutingModel.load(routing['model'])
+            except (IOError, ValueError) as e:
+                self.logger.warning(f"Failed to load routing model {routing['model']}, "
+                                    f"using createdefault: {e}")
+
+    def route(self, emails):
+        # emails: list of (subject, body). Returns the issue fields for each,
+        # falling back per field to createdefault below min_confidence.
+        defaults = {name: self.createdefault[name] for name in TARGETS}
+        if self.model is None or not emails:
+            return [dict(defaults) for _ in emails]
+        routed = []
+        for prediction in self.model.predict(emails):
+            fields = dict(defaults)
+            for name, (value, confidence) in prediction.items():
+                if confidence >= self.min_confidence:
+                    fields[name] = value
+            routed.append(fields)
+        return routed
+
+
+def train(corpus_file, model_path, n_features=2 ** 16):
+    # Corpus: JSON lines with subject, body and the labelled issue fields.
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    docs = [featurize(s['subject'], s.get('body', ''), n_features) for s in samples]
+    meta = {'n_features': n_features, 'targets': []}
+    weights = array.array('f')
+    for name in TARGETS:
+        labelled = [(doc, s[name]) for doc, s in zip(docs, samples) if name in s]
+        if not labelled:
+            continue
+        classes = sorted({label for _, label in labelled}, key=json.dumps)
+        index = {json.dumps(c): i for i, c in enumerate(classes)}
+        k = len(classes)
+        priors = [0] * k
+        counts = [[0] * k for _ in range(n_features)]
+        totals = [0] * k
+        for doc, label in labelled:
+            j = index[json.dumps(label)]
+            priors[j] += 1
+            for feature, count in doc.items():
+                counts[feature][j] += count
+                totals[j] += count
+        meta['targets'].append({'name': name, 'classes': classes, 'offset': len(weights)})
+        weights.extend(math.log(p / len(labelled)) for p in priors)
+        for row in counts:
+            weights.extend(math.log((row[j] + 1) / (totals[j] + n_features)) for j in range(k))
+    model_path = Path(__file__).resolve().parent / model_path
+    os.makedirs(model_path.parent, exist_ok=True)
+    with open(f"{model_path}.bin", 'wb') as f:
+        weights.tofile(f)
+    with open(f"{model_path}.json", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    print(f"Trained on {len(samples)} samples: {model_path}")
+
+
+def benchmark(corpus_file, model_path, min_confidence=0.6):
+    # Accuracy and batch latency of a trained model on a labelled corpus.
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    started = time.perf_counter()
+    model = RoutingModel(model_path)
+    loaded = time.perf_counter()
+    predictions = model.predict(
+        [(s['subject'], s.get('body', '')[:BODY_CHARS]) for s in samples])
+    finished = time.perf_counter()
+    results = {
+        'samples': len(samples),
+        'load_seconds': loaded - started,
+        'batch_seconds': finished - loaded,
+        'targets': {},
+    }
+    for target in model.meta['targets']:
+        name = target['name']
+        labelled = [(p[name], s[name]) for p, s in zip(predictions, samples) if name in s]
+        confident = [(value, label) for (value, confidence), label in labelled
+                     if confidence >= min_confidence]
+        results['targets'][name] = {
+            'accuracy': sum(value == label for (value, _), label in labelled) / max(len(labelled), 1),
+            'coverage': len(confident) / max(len(labelled), 1),
+            'confident_accuracy': sum(value == label for value, label in confident) / max(len(confident), 1),
+        }
+    return results
+
+
+def evaluate(corpus_file, model_path, min_confidence=0.6):
+    results = benchmark(corpus_file, model_path, min_confidence)
+    samples = results['samples']
+    print(f"Model load: {results['load_seconds'] * 1000:.1f} ms")
+    print(f"Batch of {samples}: {results['batch_seconds'] * 1000:.1f} ms "
+          f"({results['batch_seconds'] * 1e6 / max(samples, 1):.0f} us/email)")
+    for name, scores in results['targets'].items():
+        print(f"{name}: accuracy {scores['accuracy']:.3f}, "
+              f"coverage at {min_confidence} {scores['coverage']:.3f}, "
+              f"accuracy when confident {scores['confident_accuracy']:.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train or evaluate the issue routing model.')
+    parser.add_argument('command', choices=['train', 'evaluate'])
+    parser.add_argument('corpus', help='JSON lines with subject, body and labelled fields')
+    parser.add_argument('model', help='Model path without extension, e.g. data/routing/project')
+    parser.add_argument('--min-confidence', type=float, default=0.6)
+    args = parser.parse_args()
+    if args.command == 'train':
+        train(args.corpus, args.model)
+    else:
+        evaluate(args.corpus, args.model, args.min_confidence)
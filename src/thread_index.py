@@ -0,0 +1,83 @@
+import os
+import json
+import uuid
+import logging
+from pathlib import Path
+from config.settings import *
+
+
+class ThreadIndex:
+    def __init__(self,
+                 project_id = None,
+                 index_dir = REDMINE_CONFIG['thread_index_dir'],
+                 max_entries = REDMINE_CONFIG['thread_index_size']):
+        # Maps Graph conversationId and RFC 2822 Message-IDs to Redmine issue
+        # IDs so replies can be matched without searching Redmine. Entries are
+        # kept in the order they were last recorded and only the newest
+        # max_entries of each map are saved.
+        self.project_id = project_id
+        self.index_file = Path(__file__).resolve().parent / index_dir / f"{project_id}.json"
+        self.max_entries = max_entries
+        self.conversations = {}
+        self.messages = {}
+        self.changed = False
+        self.logger = logging.getLogger(__name__)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.conversations = data.get('conversations', {})
+            self.messages = data.get('messages', {})
+        except IOError as e:
+            self.logger.error(f"Failed to load thread index {self.index_file}: {e}")
+        except ValueError as e:
+            # Keep the corrupt file for inspection instead of letting the next
+            # save() overwrite it
+            corrupt_file = self.index_file.with_suffix('.corrupt')
+            os.replace(self.index_file, corrupt_file)
+            self.logger.error(f"Failed to load thread index {self.index_file}, moved to {corrupt_file}: {e}")
+
+    def save(self):
+        if not self.changed:
+            return
+        for entries in (self.conversations, self.messages):
+            for key in list(entries)[:max(len(entries) - self.max_entries, 0)]:
+                del entries[key]
+        os.makedirs(self.index_file.parent, exist_ok=True)
+        tmp_file = self.index_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'conversations': self.conversations,
+                       'messages': self.messages}, f)
+        os.replace(tmp_file, self.index_file)
+        self.changed = False
+
+    def lookup(self, conversation_id=None, message_ids=()):
+        for message_id in message_ids:
+            if message_id in self.messages:
+                return self.messages[message_id]
+        if conversation_id:
+            return self.conversations.get(conversation_id)
+        return None
+
+    def record(self, issue_id, conversation_id=None, message_ids=()):
+        # Re-recording an entry moves it to the end, so active threads are
+        # not pruned.
+        if conversation_id:
+            self.conversations.pop(conversation_id, None)
+            self.conversations[conversation_id] = issue_id
+            self.changed = True
+        for message_id in message_ids:
+            if message_id:
+                self.messages.pop(message_id, None)
+                self.messages[message_id] = issue_id
+                self.changed = True
+
+    def new_message_id(self):
+        # Message-ID for outgoing mail, so that In-Reply-To on the answer
+        # points back at an issue recorded in this index.
+        domain = APP_CONFIG['projects'][self.project_id]['email'].rsplit('@', 1)[-1]
+        return f"<{uuid.uuid4().hex}@{domain}>"
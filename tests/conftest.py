@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from config.settings import APP_CONFIG  # noqa: E402
+
+
+@pytest.fixture
+def app_config(monkeypatch):
+    config = {
+        "projects": {
+            "p": {
+                "name": "",
+                "email": "helpdesk@example.com",
+                "cache_file": "data/p.bin",
+                "enabled": True,
+                "createdefault": {
+                    "status_id": 1,
+                    "tracker_id": 2,
+                    "priority_id": 2,
+                    "assigned_to_id": None,
+                    "business_unit": [4],
+                },
+                "emailignore": {"startwith": [], "contain": [], "endwith": []},
+            }
+        },
+        "reminderconfig": {
+            "status_change": True,
+            "priority_change": False,
+            "assignee_change": False,
+            "tracker_change": False,
+            "notes_change": False,
+        },
+        "client_ID": "",
+        "tenant_ID": "",
+        "check_interval": 1,
+    }
+    monkeypatch.setattr(APP_CONFIG, "_data", config)
+    return config
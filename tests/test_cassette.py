@@ -0,0 +1,81 @@
+import base64
+import gzip
+import json
+
+import requests
+
+from cassette import Cassette, Redactor, scramble
+
+MESSAGE = {
+    "value": [{
+        "id": "AAMk1",
+        "subject": "RE: [Issue #42] Salary review for Jane",
+        "from": {"emailAddress": {"name": "Jane Doe", "address": "jane.doe@corp.com"}},
+        "body": {"contentType": "html", "content": "<p>My salary is too low</p>"},
+        "internetMessageHeaders": [
+            {"name": "In-Reply-To", "value": "<abc@corp.com>"},
+            {"name": "X-Sender-Name", "value": "Jane Doe"},
+        ],
+    }]
+}
+ATTACHMENTS = {"value": [{"name": "payslip.pdf", "contentBytes": base64.b64encode(b"secret!").decode()}]}
+USER = {"user": {"id": 3, "login": "jdoe", "firstname": "Jane", "lastname": "Doe",
+                 "mail": "jane.doe@corp.com", "api_key": "0123456789"}}
+
+
+def fake_request(session, method, url, *args, **kwargs):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    if url.endswith("/attachments"):
+        payload = ATTACHMENTS
+    elif "users" in url:
+        payload = USER
+    else:
+        payload = MESSAGE
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+def test_record_redacts_pii_and_replays_offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    cassette_file = tmp_path / "cycle.jsonl.gz"
+    urls = [
+        "https://graph.microsoft.com/v1.0/me/messages",
+        "https://graph.microsoft.com/v1.0/me/messages/AAMk1/attachments",
+        "https://redmine.example/users/current.json?key=0123456789",
+    ]
+
+    with Cassette(mode="record", cassette_file=cassette_file, latency="zero"):
+        for url in urls:
+            requests.get(url)
+
+    with gzip.open(cassette_file, "rt", encoding="utf-8") as f:
+        recorded = f.read()
+    for secret in ["Jane", "Doe", "jdoe", "jane.doe@corp.com", "salary", "payslip",
+                   "0123456789", base64.b64encode(b"secret!").decode()]:
+        assert secret not in recorded
+
+    monkeypatch.setattr(requests.Session, "request", None)
+    with Cassette(mode="replay", cassette_file=cassette_file, latency="zero"):
+        message = requests.get(urls[0]).json()["value"][0]
+        attachment = requests.get(urls[1]).json()["value"][0]
+
+    assert message["subject"] == "xx: [xxxxx #42] xxxxxx xxxxxx xxx xxxx"
+    assert message["body"]["content"] == "<p>xx xxxxxx xx xxx xxx</p>"
+    assert message["from"]["emailAddress"]["address"].endswith("@example.invalid")
+    assert message["internetMessageHeaders"][0]["value"].endswith("@example.invalid>")
+    assert base64.b64decode(attachment["contentBytes"]) == b"\0" * 7
+
+
+def test_pseudonyms_are_salted_per_cassette():
+    first, second = Redactor(), Redactor()
+
+    assert first.pseudonym("jane.doe@corp.com") == first.pseudonym("Jane.Doe@corp.com")
+    assert first.pseudonym("jane.doe@corp.com") != second.pseudonym("jane.doe@corp.com")
+
+
+def test_scramble_keeps_length_and_tags():
+    text = "<div class='a'>Hello 12</div>"
+
+    assert scramble(text) == "<div class='a'>xxxxx 12</div>"
@@ -0,0 +1,101 @@
+import re
+
+import email_reader
+from email_reader import EmailReader
+
+# Two pages of two; b and c share a timestamp across the page boundary
+MAILBOX = [
+    ("a", "2025-07-01T10:00:00Z"),
+    ("b", "2025-07-01T10:00:01Z"),
+    ("c", "2025-07-01T10:00:01Z"),
+    ("d", "2025-07-01T10:00:02Z"),
+]
+PAGE_SIZE = 2
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeGraph:
+    # Serves MAILBOX in pages, honouring the receivedDateTime filter
+    def __init__(self):
+        self.pages = []
+
+    def get(self, url, headers=None):
+        if url.endswith("/attachments"):
+            return FakeResponse({"value": []})
+        if url.startswith("page:"):
+            return FakeResponse(self.pages[int(url.split(":", 1)[1])])
+        operator, since = re.search(r"receivedDateTime (gt|ge) (\S+?)&", url).groups()
+        matching = [message(*m) for m in MAILBOX
+                    if m[1] > since or (operator == "ge" and m[1] == since)]
+        self.pages = []
+        for start in range(0, len(matching), PAGE_SIZE):
+            page = {"value": matching[start:start + PAGE_SIZE]}
+            if start + PAGE_SIZE < len(matching):
+                page["@odata.nextLink"] = f"page:{len(self.pages) + 1}"
+            self.pages.append(page)
+        return FakeResponse(self.pages[0] if self.pages else {"value": []})
+
+
+def message(message_id, received):
+    return {
+        "id": message_id,
+        "subject": f"Subject {message_id}",
+        "from": {"emailAddress": {"name": "Sender", "address": "sender@example.com"}},
+        "receivedDateTime": received,
+        "body": {"content": f"<p>Body {message_id}</p>"},
+        "conversationId": f"conv-{message_id}",
+        "internetMessageId": f"<{message_id}@example.com>",
+        "internetMessageHeaders": [],
+    }
+
+
+def run_cycle(tmp_path, max_pages=None):
+    reader = EmailReader(project_id="p",
+                         time_file=tmp_path / "processed_time.txt",
+                         attachments_folder=tmp_path / "attachments")
+    received = dict(MAILBOX)
+    handled = []
+
+    def handle_page(emails_data):
+        # The previous page is already committed when the next one arrives
+        if handled:
+            last_id = handled[-1][-1].split()[-1]
+            assert reader.time_file.read_text().split()[0] == received[last_id]
+        handled.append([e.subject for e in emails_data])
+
+    reader.catch_up(handle_page, page_size=PAGE_SIZE, max_pages=max_pages)
+    return handled
+
+
+def test_catch_up_resumes_between_messages_with_the_same_time(app_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(email_reader.requests, "get", FakeGraph().get)
+    (tmp_path / "processed_time.txt").write_text("2025-07-01T09:00:00Z")
+
+    # The page limit stops the first cycle between b and c
+    assert run_cycle(tmp_path, max_pages=1) == [["Subject a", "Subject b"]]
+    assert (tmp_path / "processed_time.txt").read_text().split() == ["2025-07-01T10:00:01Z", "b"]
+
+    assert run_cycle(tmp_path, max_pages=1) == [["Subject c"]]
+    assert (tmp_path / "processed_time.txt").read_text().split() == ["2025-07-01T10:00:01Z", "b", "c"]
+
+    assert run_cycle(tmp_path) == [["Subject d"]]
+    assert (tmp_path / "processed_time.txt").read_text().split() == ["2025-07-01T10:00:02Z", "d"]
+
+    assert run_cycle(tmp_path) == []
+
+
+def test_catch_up_commits_every_page(app_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(email_reader.requests, "get", FakeGraph().get)
+    (tmp_path / "processed_time.txt").write_text("2025-07-01T09:00:00Z")
+
+    assert run_cycle(tmp_path) == [["Subject a", "Subject b"], ["Subject c", "Subject d"]]
@@ -0,0 +1,73 @@
+import tracemalloc
+
+import email_reader
+from email_reader import EmailReader
+
+BATCH = 5000
+PAGE = 50
+SPILL_SIZE = 2048
+# Each raw payload carries an ~8 KB HTML body; the parsed records must not
+# keep that text in memory.
+PARAGRAPH = "<p>" + "The quarterly report attachment fails to open. " * 4 + "</p>"
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def graph_page(start):
+    emails = []
+    for i in range(start, min(start + PAGE, BATCH)):
+        emails.append({
+            "id": f"msg{i:05d}",
+            "subject": f"Report {i}",
+            "from": {"emailAddress": {"name": "Sender", "address": "sender@example.com"}},
+            "receivedDateTime": f"2025-07-01T10:{i // 3600 % 60:02d}:{i % 60:02d}Z",
+            "body": {"content": f"<html><body>{PARAGRAPH * 40}<p>#{i}</p></body></html>"},
+            "conversationId": f"conv{i}",
+            "internetMessageId": f"<{i}@example.com>",
+            "internetMessageHeaders": [],
+        })
+    data = {"value": emails}
+    if start + PAGE < BATCH:
+        data["@odata.nextLink"] = f"page:{start + PAGE}"
+    return data
+
+
+def fake_get(url, headers=None):
+    if url.endswith("/attachments"):
+        return FakeResponse({"value": []})
+    start = int(url.split(":", 1)[1]) if url.startswith("page:") else 0
+    return FakeResponse(graph_page(start))
+
+
+def test_reading_5000_emails_spills_bodies_and_bounds_memory(app_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(email_reader.requests, "get", fake_get)
+    reader = EmailReader(project_id="p",
+                         time_file=tmp_path / "processed_time.txt",
+                         attachments_folder=tmp_path / "attachments",
+                         body_spill_size=SPILL_SIZE)
+
+    tracemalloc.start()
+    reader.connect_read()
+    raw_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    reader.reading_emails()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(reader.emails_data) == BATCH
+    assert reader.emails == []
+    assert len(list((tmp_path / "attachments").glob("*/*.body"))) == BATCH
+    # The records keep a small fraction of the raw batch, and since raw
+    # payloads are released while parsing the peak stays below raw + records.
+    assert retained < raw_size * 0.25
+    assert peak - raw_size < retained
+    assert reader.emails_data[0].body.startswith("The quarterly report")
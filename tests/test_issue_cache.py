@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from email_reader import EmailRecord
+from issue_cache import IssueCache
+from redmine_handler import RedmineHandler
+from thread_index import ThreadIndex
+
+
+class FakeIssue:
+    def __init__(self, issue_id):
+        self.id = issue_id
+        self.subject = f"Issue {issue_id}"
+        self.updated_on = datetime(2025, 7, 1, 10, 0)
+
+    def save(self):
+        pass
+
+
+class FakeIssues:
+    # Records every issue request made by the handler
+    def __init__(self):
+        self.calls = []
+
+    def get(self, issue_id, **params):
+        self.calls.append(("get", issue_id))
+        return FakeIssue(int(issue_id))
+
+    def filter(self, **params):
+        self.calls.append(("filter", params))
+        return [FakeIssue(int(i)) for i in params["issue_id"].split(",")]
+
+
+class FakeRedmine:
+    def __init__(self):
+        self.issue = FakeIssues()
+
+
+def reply(issue_id):
+    return EmailRecord(subject=f"Issue {issue_id}", issue_id=issue_id, sender="Sender",
+                       email_addr="sender@example.com", time=None, body="Thanks",
+                       attachments=[], message_id=f"<reply-{issue_id}@example.com>")
+
+
+def write(tmp_path, issue_cache, redmine, *emails):
+    handler = RedmineHandler(project_id="p", emails_data=list(emails),
+                             issue_cache=issue_cache,
+                             thread_index=ThreadIndex(project_id="p", index_dir=tmp_path))
+    handler.redmine = redmine
+    handler.redmine_write()
+
+
+def test_reply_to_listed_issue_is_not_fetched_again(app_config, tmp_path):
+    redmine = FakeRedmine()
+    issue_cache = IssueCache()
+    # What MonitorSender.find_updated_issue_within does with its listing
+    for issue_id in [1, 2]:
+        issue_cache.put(FakeIssue(issue_id))
+
+    write(tmp_path, issue_cache, redmine, reply(2))
+
+    assert redmine.issue.calls == []
+
+
+def test_uncached_batch_is_fetched_in_one_request(app_config, tmp_path):
+    redmine = FakeRedmine()
+
+    write(tmp_path, IssueCache(), redmine, reply(3), reply(1), reply(2), reply(1))
+
+    assert redmine.issue.calls == [("filter", {"issue_id": "1,2,3", "status_id": "*"})]
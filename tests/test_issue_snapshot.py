@@ -0,0 +1,53 @@
+from redminelib import Redmine
+
+from issue_snapshot import IssueSnapshots
+
+
+def make_issue(**fields):
+    redmine = Redmine("https://redmine.example", key="key")
+    data = {
+        "id": 7,
+        "subject": "Printer",
+        "status": {"id": 1, "name": "New"},
+        "priority": {"id": 2, "name": "Normal"},
+        "tracker": {"id": 3, "name": "Support"},
+        "updated_on": "2025-07-01T10:00:00Z",
+    }
+    data.update(fields)
+    return redmine.issue.to_resource(data)
+
+
+def test_diff_handles_unassigned_issue(tmp_path):
+    snapshots = IssueSnapshots(project_id="p", snapshot_dir=tmp_path)
+    issue = make_issue()
+
+    current, changes = snapshots.diff([issue])
+
+    assert current["7"] == {
+        "status_id": 1,
+        "priority_id": 2,
+        "tracker_id": 3,
+        "assigned_to_id": None,
+    }
+    assert changes["7"] is None
+
+
+def test_diff_reports_assignee_change(tmp_path):
+    snapshots = IssueSnapshots(project_id="p", snapshot_dir=tmp_path)
+    snapshots.update(7, IssueSnapshots.fields(make_issue()))
+
+    current, changes = snapshots.diff(
+        [make_issue(assigned_to={"id": 5, "name": "Jane"})])
+
+    assert changes["7"] == ["assigned_to_id"]
+
+
+def test_save_keeps_the_most_recently_updated_issues(tmp_path):
+    snapshots = IssueSnapshots(project_id="p", snapshot_dir=tmp_path, max_issues=2)
+    fields = IssueSnapshots.fields(make_issue())
+    for issue_id in [1, 2, 1, 3]:
+        snapshots.update(issue_id, fields)
+    snapshots.save()
+
+    snapshots = IssueSnapshots(project_id="p", snapshot_dir=tmp_path, max_issues=2)
+    assert list(snapshots.issues) == ["1", "3"]
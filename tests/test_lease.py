@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import main
+from lease import LeaseLost, LeaseStore
+
+PROJECTS = ["p1", "p2", "p3", "p4"]
+
+
+def test_projects_are_balanced_between_workers(tmp_path):
+    store = tmp_path / "leases.sqlite"
+    a = LeaseStore(store_file=store, lease_seconds=60, worker_id="a")
+    b = LeaseStore(store_file=store, lease_seconds=60, worker_id="b")
+
+    assert a.claim(PROJECTS) == PROJECTS
+    assert b.claim(PROJECTS) == []
+    # a sees the second worker and releases its surplus
+    assert a.claim(PROJECTS) == ["p1", "p2"]
+    assert b.claim(PROJECTS) == ["p3", "p4"]
+
+
+def test_expired_leases_move_to_another_worker(tmp_path):
+    store = tmp_path / "leases.sqlite"
+    a = LeaseStore(store_file=store, lease_seconds=0.05, worker_id="a")
+    b = LeaseStore(store_file=store, lease_seconds=0.05, worker_id="b")
+    a.claim(PROJECTS)
+
+    time.sleep(0.1)
+
+    assert b.claim(PROJECTS) == PROJECTS
+    with pytest.raises(LeaseLost):
+        a.renew("p1")
+
+
+def test_overlapping_runs_on_one_host_do_not_share_projects(tmp_path):
+    store = tmp_path / "leases.sqlite"
+    first = LeaseStore(store_file=store, lease_seconds=60, worker_id="a")
+    second = LeaseStore(store_file=store, lease_seconds=60, worker_id="a")
+
+    assert first.claim(PROJECTS) == PROJECTS
+    assert second.claim(PROJECTS) == []
+    with pytest.raises(LeaseLost):
+        second.renew("p1")
+    first.renew("p1")
+
+    # Once the first run exits its projects are free again
+    first.release_all()
+    assert second.claim(PROJECTS) == PROJECTS
+
+
+def test_seed_state_file_copies_shared_cursor(tmp_path):
+    shared = tmp_path / "processed_time.txt"
+    shared.write_text("2025-07-01T10:00:00Z")
+    project = tmp_path / "processed_time_p1.txt"
+
+    assert main.seed_state_file(shared, project) == project
+    assert project.read_text() == "2025-07-01T10:00:00Z"
+
+    shared.write_text("2025-07-02T10:00:00Z")
+    main.seed_state_file(shared, project)
+    assert project.read_text() == "2025-07-01T10:00:00Z"
@@ -0,0 +1,57 @@
+import importlib
+import logging
+import time
+
+import pytest
+
+from config.settings import (LOGGING_CONFIG, CorrelationFilter, RepeatFilter,
+                             set_correlation_id, set_log_project)
+
+
+def make_record(message):
+    record = logging.LogRecord("email_reader", logging.INFO, __file__, 1,
+                               message, None, None)
+    CorrelationFilter().filter(record)
+    return record
+
+
+def test_repeat_filter_keeps_lines_of_other_projects_and_emails():
+    repeat = RepeatFilter(window=60)
+    passed = []
+    for project in ["a", "b", "c"]:
+        set_log_project(project)
+        for email in ["<1@x>", "<2@x>"]:
+            set_correlation_id(email)
+            passed.append(repeat.filter(make_record("One email loaded.")))
+    set_log_project(None)
+    set_correlation_id(None)
+
+    assert passed == [True] * 6
+
+
+def test_repeat_filter_drops_repeats_within_window():
+    repeat = RepeatFilter(window=60)
+
+    assert repeat.filter(make_record("Connected to Redmine."))
+    assert not repeat.filter(make_record("Connected to Redmine."))
+
+
+def test_repeat_filter_reports_dropped_count():
+    repeat = RepeatFilter(window=0.01)
+    repeat.filter(make_record("retry"))
+    repeat.filter(make_record("retry"))
+    time.sleep(0.02)
+
+    record = make_record("retry")
+    assert repeat.filter(record)
+    assert record.getMessage() == "retry (repeated 1 more times)"
+
+
+@pytest.mark.parametrize("module", [
+    "cassette", "issue_cache", "issue_snapshot", "lease", "routing", "thread_index"])
+def test_module_loggers_are_configured(module):
+    # Loggers missing from LOGGING_CONFIG fall through to the WARNING root
+    # logger and their info lines are lost
+    config = LOGGING_CONFIG["loggers"][importlib.import_module(module).__name__]
+    assert config["level"] == "INFO"
+    assert "main_handler" in config["handlers"]
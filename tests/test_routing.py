@@ -0,0 +1,104 @@
+from datetime import datetime
+from pathlib import Path
+
+from email_reader import EmailRecord
+from redmine_handler import RedmineHandler
+from routing import benchmark, train
+from thread_index import ThreadIndex
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# Floors for the fixture corpus; a regression in featurisation or scoring
+# drops accuracy far below these.
+MIN_ACCURACY = 0.9
+MAX_BATCH_SECONDS = 1.0
+
+
+def test_benchmark_on_labelled_corpus(tmp_path):
+    model = tmp_path / "routing" / "p"
+    train(FIXTURES / "routing_train.jsonl", model)
+
+    results = benchmark(FIXTURES / "routing_test.jsonl", model)
+
+    assert results["samples"] == 60
+    assert results["batch_seconds"] < MAX_BATCH_SECONDS
+    for name, scores in results["targets"].items():
+        assert scores["accuracy"] >= MIN_ACCURACY, name
+
+
+class FakeIssue:
+    def __init__(self, issue_id, subject):
+        self.id = issue_id
+        self.subject = subject
+        self.updated_on = None
+        self.saved = 0
+
+    def save(self):
+        self.saved += 1
+
+
+class FakeIssueManager:
+    def __init__(self, issues):
+        self.issues = {issue.id: issue for issue in issues}
+        self.created = []
+
+    def filter(self, issue_id=None, subject=None, **kwargs):
+        if issue_id is not None:
+            ids = {int(i) for i in issue_id.split(",")}
+            return [issue for i, issue in self.issues.items() if i in ids]
+        return [issue for issue in self.issues.values() if issue.subject == subject]
+
+    def create(self, **fields):
+        issue = FakeIssue(100 + len(self.created), fields["subject"])
+        issue.created_on = None
+        self.created.append(fields)
+        self.issues[issue.id] = issue
+        return issue
+
+
+class FakeRedmine:
+    def __init__(self, issues):
+        self.issue = FakeIssueManager(issues)
+
+
+class RecordingRouter:
+    def __init__(self):
+        self.calls = []
+
+    def route(self, emails):
+        self.calls.append(emails)
+        return [{"tracker_id": 9, "priority_id": 9, "assigned_to_id": 9} for _ in emails]
+
+
+def make_email(subject, issue_id=None, conversation_id=None, body="body"):
+    return EmailRecord(subject=subject, issue_id=issue_id, sender="Sender",
+                       email_addr="sender@example.com", time=datetime.now(),
+                       body=body, attachments=[], conversation_id=conversation_id)
+
+
+def test_only_new_issues_are_routed_in_one_call(app_config, tmp_path):
+    existing = FakeIssue(1, "Existing")
+    emails = [
+        make_email("Reply by id", issue_id=1),
+        make_email("Existing"),
+        make_email("New printer", body="x" * 5000),
+        make_email("New printer"),
+        make_email("Another", conversation_id="c1"),
+    ]
+    handler = RedmineHandler(project_id="p", emails_data=emails)
+    handler.redmine = FakeRedmine([existing])
+    handler.thread_index = ThreadIndex(project_id="p", index_dir=tmp_path)
+    handler.router = RecordingRouter()
+    handler.send_email = lambda html_body=None: None
+
+    handler.redmine_write()
+
+    assert len(handler.router.calls) == 1
+    routed = handler.router.calls[0]
+    assert [subject for subject, _ in routed] == ["New printer", "Another"]
+    assert len(routed[0][1]) == 2000
+    created = handler.redmine.issue.created
+    assert [fields["subject"] for fields in created] == ["New printer", "Another"]
+    assert all(fields["tracker_id"] == 9 for fields in created)
+    assert existing.saved == 2
+    assert handler.redmine.issue.issues[100].saved == 1
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+from conftest import SRC_DIR
+
+# Importing main used to pull in msal, bs4, html2text, redminelib and loguru
+# (about 350 ms); without them it takes a few tens of milliseconds.
+IMPORT_LIMIT_US = 150_000
+HEAVY_MODULES = ["msal", "bs4", "html2text", "redminelib", "loguru"]
+
+
+def import_times(code):
+    # Top-level entries of -X importtime; each one's cumulative time already
+    # includes everything it imported.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_main_is_fast():
+    startup = import_times("pass")
+    times = import_times("import main")
+
+    total = sum(t for name, t in times.items() if name not in startup)
+
+    assert total < IMPORT_LIMIT_US, f"import main took {total} us"
+
+
+def test_import_main_skips_heavy_modules():
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, main; print(' '.join(sorted(sys.modules)))"],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    loaded = set(result.stdout.split())
+
+    assert [m for m in HEAVY_MODULES if m in loaded] == []
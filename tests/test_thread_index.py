@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import redmine_handler
+from email_reader import EmailRecord
+from redmine_handler import RedmineHandler
+from thread_index import ThreadIndex
+
+
+class FakeIssue:
+    def __init__(self, issue_id):
+        self.id = issue_id
+        self.updated_on = "2025-07-01T10:00:00Z"
+
+
+class FakeIssues:
+    def filter(self, issue_id=None, subject=None, **params):
+        # Only the thread index may be used to match these replies
+        assert subject is None, "reply was matched by subject search"
+        return [FakeIssue(int(i)) for i in issue_id.split(",")]
+
+
+class FakeRedmine:
+    issue = FakeIssues()
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def make_handler(tmp_path, *emails):
+    handler = RedmineHandler(project_id="p", emails_data=list(emails),
+                             thread_index=ThreadIndex(project_id="p", index_dir=tmp_path))
+    handler.redmine = FakeRedmine()
+    return handler
+
+
+def reply(subject, conversation_id=None, in_reply_to=()):
+    return EmailRecord(subject=subject, issue_id=None, sender="Sender",
+                       email_addr="sender@example.com", time=None, body="Thanks",
+                       attachments=[], conversation_id=conversation_id,
+                       message_id="<reply@example.com>", in_reply_to=in_reply_to)
+
+
+def test_reply_with_rewritten_subject_matches_by_in_reply_to(app_config, tmp_path):
+    handler = make_handler(tmp_path, reply("Something else entirely",
+                                           conversation_id="new-conversation",
+                                           in_reply_to=("<confirmation@example.com>",)))
+    handler.thread_index.record(42, message_ids=("<confirmation@example.com>",))
+
+    handler.load_email(0)
+
+    assert handler.match_issue().id == 42
+
+
+def test_reply_with_rewritten_subject_matches_by_conversation(app_config, tmp_path):
+    handler = make_handler(tmp_path, reply("Something else entirely",
+                                           conversation_id="conversation-1"))
+    handler.thread_index.record(42, conversation_id="conversation-1")
+
+    handler.load_email(0)
+
+    assert handler.match_issue().id == 42
+
+
+@pytest.mark.parametrize("status_code, recorded", [(202, True), (500, False)])
+def test_confirmation_message_id_is_recorded_only_when_sent(
+        app_config, tmp_path, monkeypatch, status_code, recorded):
+    sent = []
+
+    def post(url, headers=None, data=None):
+        sent.append(json.loads(data)["message"]["internetMessageId"])
+        return FakeResponse(status_code)
+
+    monkeypatch.setattr(redmine_handler.requests, "post", post)
+    handler = make_handler(tmp_path, reply("Printer"))
+    handler.load_email(0)
+    handler.issue = FakeIssue(42)
+
+    handler.send_email("<p>Issue created</p>")
+
+    assert sent[0].endswith("@example.com>")
+    assert (handler.thread_index.lookup(message_ids=sent) == 42) is recorded
+
+
+def test_save_keeps_the_most_recently_recorded_entries(tmp_path):
+    index = ThreadIndex(project_id="p", index_dir=tmp_path, max_entries=2)
+    index.record(1, "c1", ["<1@x>"])
+    index.record(2, "c2", ["<2@x>"])
+    index.record(1, "c1", ["<1@x>"])
+    index.record(3, "c3", ["<3@x>"])
+    index.save()
+
+    index = ThreadIndex(project_id="p", index_dir=tmp_path, max_entries=2)
+    assert index.conversations == {"c1": 1, "c3": 3}
+    assert index.messages == {"<1@x>": 1, "<3@x>": 3}